@@ -1,6 +1,5 @@
 from nmigen import *
 from nmigen.back.pysim import *
-from nmigen_boards.upduino_v2 import *
 
 from isa import *
 
@@ -58,10 +57,12 @@ class ALU( Elaboratable ):
       # Also, left shifts are implemented by flipping the inputs
       # and outputs of a right shift operation in the CPU logic.
       # Y = A >> B
+      # Logical and arithmetic shifts share one 33-bit arithmetic
+      # shifter; the extra MSbit is only set for arithmetic shifts.
       with m.Case( ALU_SRL & 0b111 ):
-        m.d.comb += self.y.eq( Mux( self.f[ 3 ],
-          self.a.as_signed() >> ( self.b[ :5 ] ),
-          self.a >> ( self.b[ :5 ] ) ) )
+        m.d.comb += self.y.eq(
+          ( Cat( self.a, self.a[ 31 ] & self.f[ 3 ] ).as_signed() >>
+            self.b[ :5 ] )[ :32 ] )
 
     # End of ALU module definition.
     return m
@@ -182,6 +183,7 @@ def alu_test( alu ):
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
   if ( len( sys.argv ) == 2 ) and ( sys.argv[ 1 ] == '-b' ):
+    from nmigen_boards.upduino_v2 import *
     # Test building the module.
     UpduinoV2Platform().build( ALU(),
                                do_build = True,
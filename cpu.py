@@ -1,6 +1,5 @@
 from nmigen import *
 from nmigen.back.pysim import *
-from nmigen_boards.upduino_v2 import *
 
 from alu import *
 from csr import *
@@ -10,8 +9,15 @@ from spi_rom import *
 from rom import *
 from rvmem import *
 
+import concurrent.futures
+import contextlib
+import io
+import itertools
 import os
+import shutil
+import subprocess
 import sys
+import traceback
 import warnings
 
 # Optional: Enable verbose output for debugging.
@@ -19,12 +25,16 @@ import warnings
 
 # CPU module.
 class CPU( Elaboratable ):
-  def __init__( self, rom_module ):
+  def __init__( self, rom_module, ram_init = None ):
     # CPU signals:
     # 'Reset' signal for clock domains.
     self.clk_rst = Signal( reset = 0b0, reset_less = True )
     # Program Counter register.
     self.pc = Signal( 32, reset = 0x00000000 )
+    # Trap request signals: trap number and return address.
+    self.trap     = Signal( 1,  reset = 0b0 )
+    self.trap_num = Signal( 5,  reset = 0b00000 )
+    self.trap_pc  = Signal( 32, reset = 0x00000000 )
     # The main 32 CPU registers.
     self.r      = Memory( width = 32, depth = 32,
                           init = ( 0x00000000 for i in range( 32 ) ) )
@@ -39,24 +49,17 @@ class CPU( Elaboratable ):
     # CSR 'system registers'.
     self.csr    = CSR()
     # Memory module to hold peripherals and ROM / RAM module(s)
-    # (4KB of RAM = 1024 words)
-    self.mem    = RV_Memory( rom_module, 1024 )
+    # (4KB of RAM = 1024 words, optionally with initial values)
+    self.mem    = RV_Memory( rom_module, 1024, ram_init )
 
-  # Helper method to enter a trap handler: jump to the appropriate
-  # address, and set the MCAUSE / MEPC CSRs.
+  # Helper method to enter a trap handler. This only requests the
+  # trap; the jump and CSR updates are applied once, at the end of
+  # the 'elaborate' method.
   def trigger_trap( self, m, trap_num, return_pc ):
-    m.d.sync += [
-      # Set mcause, mepc, interrupt context flag.
-      # (mcause is currently disabled to save space)
-      #self.csr.mcause_interrupt.eq( 0 ),
-      #self.csr.mcause_ecode.eq( trap_num ),
-      self.csr.mepc_mepc.eq( return_pc.bit_select( 2, 30 ) ),
-      # Disable interrupts globally until MRET or CSR write.
-      self.csr.mstatus_mie.eq( 0 ),
-      # Set PC to the interrupt handler address.
-      self.pc.eq( Cat( Repl( 0, 2 ),
-                      ( self.csr.mtvec_base +
-                        Mux( self.csr.mtvec_mode, trap_num, 0 ) ) ) )
+    m.d.comb += [
+      self.trap.eq( 1 ),
+      self.trap_num.eq( trap_num ),
+      self.trap_pc.eq( return_pc )
     ]
 
   # CPU object's 'elaborate' method to generate the hardware logic.
@@ -75,6 +78,74 @@ class CPU( Elaboratable ):
     # Wait-state counter to let internal memories load.
     iws = Signal( 2, reset = 0 )
 
+    # CPU register write request. Writes to r0 are always discarded,
+    # so that check only needs to happen in one place.
+    rc_we = Signal()
+    m.d.comb += self.rc.en.eq( rc_we & ( self.rc.addr != 0 ) )
+
+    # 'Execute' flag: set while the current instruction is being
+    # executed, unless an interrupt is taken instead.
+    ex = Signal()
+
+    # Shared sign-extended I / S-type immediate, used by I-type ALU
+    # operations, JALR, loads and stores. (S-type immediates only
+    # differ from I-type ones in their 5 LSbits, which are selected
+    # for store opcodes.)
+    imm_is = Signal( 32, reset = 0x00000000 )
+    m.d.comb += imm_is.eq( Cat(
+      Mux( self.mem.imux.bus.dat_r[ 5 ] & ~self.mem.imux.bus.dat_r[ 6 ],
+           self.mem.imux.bus.dat_r[ 7 : 12 ],
+           self.mem.imux.bus.dat_r[ 20 : 25 ] ),
+      self.mem.imux.bus.dat_r[ 25 : 32 ],
+      Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) )
+
+    # Shared address adders: 'tgt_pc' is the PC-relative JAL / branch
+    # target, and 'tgt_mp' is the register-relative JALR target or
+    # load / store address.
+    tgt_pc = Signal( 32, reset = 0x00000000 )
+    tgt_mp = Signal( 32, reset = 0x00000000 )
+    m.d.comb += [
+      tgt_pc.eq( self.pc + Mux( self.mem.imux.bus.dat_r[ 2 ],
+        Cat( Repl( 0, 1 ),
+             self.mem.imux.bus.dat_r[ 21: 31 ],
+             self.mem.imux.bus.dat_r[ 20 ],
+             self.mem.imux.bus.dat_r[ 12 : 20 ],
+             Repl( self.mem.imux.bus.dat_r[ 31 ], 12 ) ),
+        Cat( Repl( 0, 1 ),
+             self.mem.imux.bus.dat_r[ 8 : 12 ],
+             self.mem.imux.bus.dat_r[ 25 : 31 ],
+             self.mem.imux.bus.dat_r[ 7 ],
+             Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) ) ),
+      tgt_mp.eq( self.ra.data + imm_is ),
+      # Loads and stores use the same data bus address.
+      self.mem.dmux.bus.adr.eq( tgt_mp )
+    ]
+
+    # Branch condition signals: one equality check and one signed /
+    # one unsigned comparator, shared by every branch instruction.
+    br_eq   = Signal()
+    br_lts  = Signal()
+    br_ltu  = Signal()
+    br_take = Signal()
+    m.d.comb += [
+      br_eq.eq( self.ra.data == self.rb.data ),
+      br_lts.eq( self.ra.data.as_signed() < self.rb.data.as_signed() ),
+      br_ltu.eq( self.ra.data < self.rb.data )
+    ]
+    with m.Switch( self.mem.imux.bus.dat_r[ 12 : 15 ] ):
+      with m.Case( F_BEQ ):
+        m.d.comb += br_take.eq( br_eq )
+      with m.Case( F_BNE ):
+        m.d.comb += br_take.eq( ~br_eq )
+      with m.Case( F_BLT ):
+        m.d.comb += br_take.eq( br_lts )
+      with m.Case( F_BGE ):
+        m.d.comb += br_take.eq( ~br_lts )
+      with m.Case( F_BLTU ):
+        m.d.comb += br_take.eq( br_ltu )
+      with m.Case( F_BGEU ):
+        m.d.comb += br_take.eq( ~br_ltu )
+
     # Top-level combinatorial logic.
     m.d.comb += [
       # Set CPU register access addresses.
@@ -83,12 +154,14 @@ class CPU( Elaboratable ):
       self.rc.addr.eq( self.mem.imux.bus.dat_r[ 7  : 12 ] ),
       # Instruction bus address is always set to the program counter.
       self.mem.imux.bus.adr.eq( self.pc ),
-      # The CSR inputs are always wired the same.
+      # The CSR inputs are always wired the same. funct3[ 2 ]
+      # selects the sign-extended 5-bit immediate ('CSRR[WSC]I')
+      # over the 'rs1' register value ('CSRR[WSC]').
       self.csr.dat_w.eq(
-        Mux( self.mem.imux.bus.dat_r[ 14 ] == 0,
-             self.ra.data,
+        Mux( self.mem.imux.bus.dat_r[ 14 ],
              Cat( self.ra.addr,
-                  Repl( self.ra.addr[ 4 ], 27 ) ) ) ),
+                  Repl( self.ra.addr[ 4 ], 27 ) ),
+             self.ra.data ) ),
       self.csr.f.eq( self.mem.imux.bus.dat_r[ 12 : 15 ] ),
       self.csr.adr.eq( self.mem.imux.bus.dat_r[ 20 : 32 ] ),
       # Store data and width are always wired the same.
@@ -96,14 +169,10 @@ class CPU( Elaboratable ):
       self.mem.dmux.bus.dat_w.eq( self.rb.data ),
     ]
 
-    # Trigger an 'instruction mis-aligned' trap if necessary.
-    with m.If( self.pc[ :2 ] != 0 ):
-      # (mtval is currently disabled to save space.)
-      #m.d.sync += self.csr.mtval_einfo.eq( self.pc )
-      self.trigger_trap( m, TRAP_IMIS, Past( self.pc ) )
-    with m.Else():
-      # I-bus is active until it completes a transaction.
-      m.d.comb += self.mem.imux.bus.cyc.eq( iws == 0 )
+    # I-bus is active until it completes a transaction.
+    # (Jump / branch targets are checked for alignment before they
+    #  are taken, so the PC is always word-aligned here.)
+    m.d.comb += self.mem.imux.bus.cyc.eq( iws == 0 )
 
     # Wait a cycle after 'ack' to load the appropriate CPU registers.
     with m.If( self.mem.imux.bus.ack ):
@@ -141,232 +210,181 @@ class CPU( Elaboratable ):
         condition = m.Elif
 
       # If no interrupt is pending, process the instruction normally.
+      # (RV32I opcodes all end in 0b11; other encodings are not
+      #  supported, so they are ignored and act like no-ops.)
       with m.Else():
-        # Decoder switch case:
-        with m.Switch( self.mem.imux.bus.dat_r[ 0 : 7 ] ):
-          # LUI / AUIPC / R-type / I-type instructions: apply
-          # pending CPU register write.
-          with m.Case( '0-10-11' ):
-            m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
-
-          # JAL / JALR instructions: jump to a new address and place
-          # the 'return PC' in the destination register (rc).
-          with m.Case( '110-111' ):
-            m.d.sync += self.pc.eq(
-              Mux( self.mem.imux.bus.dat_r[ 3 ],
-                   self.pc + Cat(
-                     Repl( 0, 1 ),
-                     self.mem.imux.bus.dat_r[ 21: 31 ],
-                     self.mem.imux.bus.dat_r[ 20 ],
-                     self.mem.imux.bus.dat_r[ 12 : 20 ],
-                     Repl( self.mem.imux.bus.dat_r[ 31 ], 12 ) ),
-                   self.ra.data + Cat(
-                     self.mem.imux.bus.dat_r[ 20 : 32 ],
-                     Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) ),
-            )
-            m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
-
-          # Conditional branch instructions: similar to JAL / JALR,
-          # but only take the branch if the condition is met.
-          with m.Case( OP_BRANCH ):
-            # Check the ALU result. If it is zero, then:
-            # a == b for BEQ/BNE, or a >= b for BLT[U]/BGE[U].
-            with m.If( ( ( self.alu.y == 0 ) ^
-                           self.mem.imux.bus.dat_r[ 12 ] ) !=
-                         self.mem.imux.bus.dat_r[ 14 ] ):
-              # Branch only if the condition is met.
-              m.d.sync += self.pc.eq( self.pc + Cat(
-                Repl( 0, 1 ),
-                self.mem.imux.bus.dat_r[ 8 : 12 ],
-                self.mem.imux.bus.dat_r[ 25 : 31 ],
-                self.mem.imux.bus.dat_r[ 7 ],
-                Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) )
-
-          # Load / Store instructions: perform memory access
-          # through the data bus.
-          with m.Case( '0-00011' ):
-            # Trigger a trap if the address is mis-aligned.
-            # * Byte accesses are never mis-aligned.
-            # * Word-aligned accesses are never mis-aligned.
-            # * Halfword accesses are only mis-aligned when both of
-            #   the address' LSbits are 1s.
-            # Since this logic only depends on 4 bits as inputs,
-            # it should fit in one LUT4. (adr[0], adr[1], f[0], f[1])
-            with m.If( ( ( self.mem.dmux.bus.adr[ :2 ] == 0 ) |
-                         ( self.mem.imux.bus.dat_r[ 12 : 14 ] == 0 ) |
-                         ( ~( self.mem.dmux.bus.adr[ 0 ] &
-                              self.mem.dmux.bus.adr[ 1 ] &
-                              self.mem.imux.bus.dat_r[ 12 ] ) ) ) == 0 ):
-              self.trigger_trap( m,
-                Cat( Repl( 0, 1 ),
-                     self.mem.imux.bus.dat_r[ 5 ],
-                     Repl( 1, 1 ) ),
-                Past( self.pc ) )
-            with m.Else():
-              # Activate the data bus.
-              m.d.comb += [
-                self.mem.dmux.bus.cyc.eq( 1 ),
-                # Stores only: set the 'write enable' bit.
-                self.mem.dmux.bus.we.eq( self.mem.imux.bus.dat_r[ 5 ] )
-              ]
-              # Don't proceed until the memory access finishes.
-              with m.If( self.mem.dmux.bus.ack == 0 ):
-                m.d.sync += [
-                  self.pc.eq( self.pc ),
-                  iws.eq( 2 )
-                ]
-              # Loads only: write to the CPU register.
-              with m.Elif( self.mem.imux.bus.dat_r[ 5 ] == 0 ):
-                m.d.comb += self.rc.en.eq( self.rc.addr != 0 )
-
-          # System call instruction: ECALL, EBREAK, MRET,
-          # and atomic CSR operations.
-          with m.Case( OP_SYSTEM ):
-            with m.If( self.mem.imux.bus.dat_r[ 12 : 15 ] == 0 ):
-              with m.Switch( self.mem.imux.bus.dat_r[ 20 : 22 ] ):
-                # An 'empty' ECALL instruction should raise an
-                # 'environment-call-from-M-mode" exception.
-                with m.Case( 0 ):
-                  self.trigger_trap( m, TRAP_ECALL, Past( self.pc ) )
-                # "EBREAK" instruction: enter the interrupt context
-                # with 'breakpoint' as the cause of the exception.
-                with m.Case( 1 ):
-                  self.trigger_trap( m, TRAP_BREAK, Past( self.pc ) )
-                # 'MRET' jumps to the stored 'pre-trap' PC in the
-                # 30 MSbits of the MEPC CSR.
-                with m.Case( 2 ):
-                  m.d.sync += [
-                    self.csr.mstatus_mie.eq( 1 ),
-                    self.pc.eq( Cat( Repl( 0, 2 ),
-                                     self.csr.mepc_mepc ) )
-                  ]
-            # Defer to the CSR module for atomic CSR reads/writes.
-            # 'CSRR[WSC]': Write/Set/Clear CSR value from a register.
-            # 'CSRR[WSC]I': Write/Set/Clear CSR value from immediate.
-            with m.Else():
-              m.d.comb += [
-                self.rc.data.eq( self.csr.dat_r ),
-                self.rc.en.eq( self.rc.addr != 0 ),
-                self.csr.we.eq( 1 )
-              ]
-
-          # FENCE instruction: clear any I-caches and ensure all
-          # memory operations are applied. There is no I-cache,
-          # and there is no caching of memory operations.
-          # There is also no pipelining. So...this is a nop.
-          with m.Case( OP_FENCE ):
-            pass
-
-    # 'Always-on' decode/execute logic:
-    with m.Switch( self.mem.imux.bus.dat_r[ 0 : 7 ] ):
+        m.d.comb += ex.eq( self.mem.imux.bus.dat_r[ 0 : 2 ] == 0b11 )
+
+    # Decode / execute logic: the datapath (register write data and
+    # ALU inputs) is always driven from the current instruction,
+    # and the 'ex' flag gates the control logic which commits it.
+    # (Only the 5 opcode bits above the '0b11' suffix are needed
+    #  to tell RV32I opcodes apart; 'ex' is only set for words
+    #  which end in that suffix.)
+    with m.Switch( self.mem.imux.bus.dat_r[ 2 : 7 ] ):
       # LUI / AUIPC instructions: set destination register to
       # 20 upper bits, +pc for AUIPC.
-      with m.Case( '0-10111' ):
+      with m.Case( '0-101' ):
         m.d.comb += self.rc.data.eq(
           Mux( self.mem.imux.bus.dat_r[ 5 ], 0, self.pc ) +
           Cat( Repl( 0, 12 ),
                self.mem.imux.bus.dat_r[ 12 : 32 ] ) )
+        with m.If( ex ):
+          m.d.comb += rc_we.eq( 1 )
 
-      # JAL / JALR instructions: set destination register to
-      # the 'return PC' value.
-      with m.Case( '110-111' ):
+      # JAL / JALR instructions: jump to a new address and place
+      # the 'return PC' in the destination register (rc).
+      with m.Case( '110-1' ):
         m.d.comb += self.rc.data.eq( self.pc + 4 )
-
-      # Conditional branch instructions:
-      # set us up the ALU for the condition check.
-      with m.Case( OP_BRANCH ):
-        # BEQ / BNE: use SUB ALU operation to check equality.
-        # BLT / BGE / BLTU / BGEU: use SLT or SLTU ALU operation.
-        m.d.comb += [
-          self.alu.a.eq( self.ra.data ),
-          self.alu.b.eq( self.rb.data ),
-          self.alu.f.eq( Mux(
-            self.mem.imux.bus.dat_r[ 14 ],
-            Cat( self.mem.imux.bus.dat_r[ 13 ], 0b001 ),
-            0b1000 ) )
-        ]
-
-      # Load instructions: Set the memory address and data register.
-      with m.Case( OP_LOAD ):
-        m.d.comb += [
-          self.mem.dmux.bus.adr.eq( self.ra.data +
-            Cat( self.mem.imux.bus.dat_r[ 20 : 32 ],
-                 Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) ),
-          self.rc.data.bit_select( 0, 8 ).eq(
-            self.mem.dmux.bus.dat_r[ :8 ] )
-        ]
-        with m.If( self.mem.imux.bus.dat_r[ 12 ] ):
-          m.d.comb += [
-            self.rc.data.bit_select( 8, 8 ).eq(
-              self.mem.dmux.bus.dat_r[ 8 : 16 ] ),
-            self.rc.data.bit_select( 16, 16 ).eq(
-              Repl( ( self.mem.imux.bus.dat_r[ 14 ] == 0 ) &
-                    self.mem.dmux.bus.dat_r[ 15 ], 16 ) )
-          ]
-        with m.Elif( self.mem.imux.bus.dat_r[ 13 ] ):
-          m.d.comb += self.rc.data.bit_select( 8, 24 ).eq(
-            self.mem.dmux.bus.dat_r[ 8 : 32 ] )
-        with m.Else():
-          m.d.comb += self.rc.data.bit_select( 8, 24 ).eq(
-            Repl( ( self.mem.imux.bus.dat_r[ 14 ] == 0 ) &
-                  self.mem.dmux.bus.dat_r[ 7 ], 24 ) )
-
-      # Store instructions: Set the memory address.
-      with m.Case( OP_STORE ):
-        m.d.comb += self.mem.dmux.bus.adr.eq( self.ra.data +
-          Cat( self.mem.imux.bus.dat_r[ 7 : 12 ],
-               self.mem.imux.bus.dat_r[ 25 : 32 ],
-               Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) )
-
-      # R-type ALU operation: set inputs for rc = ra ? rb
-      with m.Case( OP_REG ):
-        # Implement left shifts using the right shift ALU operation.
-        with m.If( self.mem.imux.bus.dat_r[ 12 : 15 ] == 0b001 ):
-          m.d.comb += [
-            self.alu.a.eq( FLIP( self.ra.data ) ),
-            self.alu.f.eq( 0b0101 ),
-            self.rc.data.eq( FLIP( self.alu.y ) )
-          ]
-        with m.Else():
-          m.d.comb += [
-            self.alu.a.eq( self.ra.data ),
-            self.alu.f.eq( Cat(
-              self.mem.imux.bus.dat_r[ 12 : 15 ],
-              self.mem.imux.bus.dat_r[ 30 ] ) ),
-            self.rc.data.eq( self.alu.y ),
-          ]
-        m.d.comb += self.alu.b.eq( self.rb.data )
-
-      # I-type ALU operation: set inputs for rc = ra ? immediate
-      with m.Case( OP_IMM ):
-        # Shift operations are a bit different from normal I-types.
-        # They use 'funct7' bits like R-type operations, and the
-        # left shift can be implemented as a right shift to avoid
-        # having two barrel shifters in the ALU.
-        with m.If( self.mem.imux.bus.dat_r[ 12 : 14 ] == 0b01 ):
-          with m.If( self.mem.imux.bus.dat_r[ 14 ] == 0 ):
-            m.d.comb += [
-              self.alu.a.eq( FLIP( self.ra.data ) ),
-              self.alu.f.eq( 0b0101 ),
-              self.rc.data.eq( FLIP( self.alu.y ) ),
-            ]
+        with m.If( ex ):
+          # JALR clears its target address' LSbit. A target which is
+          # still not word-aligned triggers an 'instruction
+          # mis-aligned' trap on the jump itself, and the 'return
+          # PC' is not written.
+          # (mtval is currently disabled to save space.)
+          with m.If( Mux( self.mem.imux.bus.dat_r[ 3 ],
+                          tgt_pc[ 1 ], tgt_mp[ 1 ] ) ):
+            self.trigger_trap( m, TRAP_IMIS, self.pc )
+          with m.Else():
+            m.d.sync += self.pc.eq(
+              Mux( self.mem.imux.bus.dat_r[ 3 ], tgt_pc,
+                   Cat( Repl( 0, 1 ), tgt_mp[ 1 : 32 ] ) ) )
+            m.d.comb += rc_we.eq( 1 )
+
+      # Conditional branch instructions: similar to JAL / JALR,
+      # but only take the branch if the condition is met.
+      with m.Case( OP_BRANCH >> 2 ):
+        with m.If( ex & br_take ):
+          # Mis-aligned branch targets trap like mis-aligned jumps.
+          with m.If( tgt_pc[ 1 ] ):
+            self.trigger_trap( m, TRAP_IMIS, self.pc )
           with m.Else():
+            m.d.sync += self.pc.eq( tgt_pc )
+
+      # Load / Store instructions: perform memory access
+      # through the data bus.
+      with m.Case( '0-000' ):
+        # Loads only: sign- or zero-extend the loaded value to fill
+        # the register. funct3[ :2 ] is the access size (byte /
+        # halfword / word), and funct3[ 2 ] is set for unsigned loads.
+        m.d.comb += self.rc.data.eq(
+          Mux( self.mem.imux.bus.dat_r[ 13 ],
+               self.mem.dmux.bus.dat_r,
+               Mux( self.mem.imux.bus.dat_r[ 12 ],
+                    SEXT( self.mem.dmux.bus.dat_r, 16,
+                          ~self.mem.imux.bus.dat_r[ 14 ] ),
+                    SEXT( self.mem.dmux.bus.dat_r, 8,
+                          ~self.mem.imux.bus.dat_r[ 14 ] ) ) ) )
+        with m.If( ex ):
+          # Trigger a trap if the address is mis-aligned.
+          # * Byte accesses are never mis-aligned.
+          # * Word-aligned accesses are never mis-aligned.
+          # * Halfword accesses are only mis-aligned when both of
+          #   the address' LSbits are 1s.
+          # That reduces to a 3-input AND of the address' LSbits
+          # and the 'halfword' funct3 bit, which fits in one LUT.
+          with m.If( self.mem.dmux.bus.adr[ 0 ] &
+                     self.mem.dmux.bus.adr[ 1 ] &
+                     self.mem.imux.bus.dat_r[ 12 ] ):
+            self.trigger_trap( m,
+              Cat( Repl( 0, 1 ),
+                   self.mem.imux.bus.dat_r[ 5 ],
+                   Repl( 1, 1 ) ),
+              self.pc )
+          with m.Else():
+            # Activate the data bus.
             m.d.comb += [
-              self.alu.a.eq( self.ra.data ),
-              self.alu.f.eq( Cat( 0b101, self.mem.imux.bus.dat_r[ 30 ] ) ),
-              self.rc.data.eq( self.alu.y ),
+              self.mem.dmux.bus.cyc.eq( 1 ),
+              # Stores only: set the 'write enable' bit.
+              self.mem.dmux.bus.we.eq( self.mem.imux.bus.dat_r[ 5 ] )
             ]
-        # Normal I-type operation:
+            # Don't proceed until the memory access finishes.
+            with m.If( self.mem.dmux.bus.ack == 0 ):
+              m.d.sync += [
+                self.pc.eq( self.pc ),
+                iws.eq( 2 )
+              ]
+            # Loads only: write to the CPU register.
+            with m.Elif( self.mem.imux.bus.dat_r[ 5 ] == 0 ):
+              m.d.comb += rc_we.eq( 1 )
+
+      # System call instruction: ECALL, EBREAK, MRET,
+      # and atomic CSR operations.
+      with m.Case( OP_SYSTEM >> 2 ):
+        with m.If( self.mem.imux.bus.dat_r[ 12 : 15 ] == 0 ):
+          with m.If( ex ):
+            with m.Switch( self.mem.imux.bus.dat_r[ 20 : 22 ] ):
+              # An 'empty' ECALL instruction should raise an
+              # 'environment-call-from-M-mode" exception.
+              with m.Case( 0 ):
+                self.trigger_trap( m, TRAP_ECALL, self.pc )
+              # "EBREAK" instruction: enter the interrupt context
+              # with 'breakpoint' as the cause of the exception.
+              with m.Case( 1 ):
+                self.trigger_trap( m, TRAP_BREAK, self.pc )
+              # 'MRET' jumps to the stored 'pre-trap' PC in the
+              # 30 MSbits of the MEPC CSR.
+              with m.Case( 2 ):
+                m.d.sync += [
+                  self.csr.mstatus_mie.eq( 1 ),
+                  self.pc.eq( Cat( Repl( 0, 2 ),
+                                   self.csr.mepc_mepc ) )
+                ]
+        # Defer to the CSR module for atomic CSR reads/writes.
+        # 'CSRR[WSC]': Write/Set/Clear CSR value from a register.
+        # 'CSRR[WSC]I': Write/Set/Clear CSR value from immediate.
         with m.Else():
-          m.d.comb += [
-            self.alu.a.eq( self.ra.data ),
-            self.alu.f.eq( self.mem.imux.bus.dat_r[ 12 : 15 ] ),
-            self.rc.data.eq( self.alu.y ),
-          ]
-        # Shared I-type logic:
-        m.d.comb += self.alu.b.eq( Cat(
-          self.mem.imux.bus.dat_r[ 20 : 32 ],
-          Repl( self.mem.imux.bus.dat_r[ 31 ], 20 ) ) )
+          m.d.comb += self.rc.data.eq( self.csr.dat_r )
+          with m.If( ex ):
+            m.d.comb += [
+              rc_we.eq( 1 ),
+              self.csr.we.eq( 1 )
+            ]
+
+      # R-type / I-type ALU operations: set inputs for
+      # rc = ra ? rb (R-type) or rc = ra ? immediate (I-type).
+      with m.Case( '0-100' ):
+        # Left shifts are implemented using the right shift ALU
+        # operation, by flipping its input and output bits. That
+        # avoids having two barrel shifters in the ALU.
+        # The 'funct7' bit which selects SUB / SRA is only used for
+        # R-type operations and right shifts; I-type operations
+        # other than shifts use those bits for their immediate.
+        sll = ( self.mem.imux.bus.dat_r[ 12 : 15 ] == 0b001 )
+        m.d.comb += [
+          self.alu.a.eq( Mux( sll, FLIP( self.ra.data ), self.ra.data ) ),
+          self.alu.b.eq( Mux( self.mem.imux.bus.dat_r[ 5 ],
+                              self.rb.data, imm_is ) ),
+          self.alu.f.eq( Cat(
+            Mux( sll, 0b101, self.mem.imux.bus.dat_r[ 12 : 15 ] ),
+            self.mem.imux.bus.dat_r[ 30 ] &
+            ( self.mem.imux.bus.dat_r[ 5 ] |
+              self.mem.imux.bus.dat_r[ 14 ] ) ) ),
+          self.rc.data.eq( Mux( sll, FLIP( self.alu.y ), self.alu.y ) )
+        ]
+        with m.If( ex ):
+          m.d.comb += rc_we.eq( 1 )
+
+      # (FENCE instructions do not need a case: there is no
+      #  I-cache, no caching of memory operations, and no
+      #  pipelining, so they act like any other no-op.)
+
+    # Enter a trap handler if necessary: jump to the appropriate
+    # address, and set the MCAUSE / MEPC CSRs.
+    with m.If( self.trap ):
+      m.d.sync += [
+        # Set mcause, mepc, interrupt context flag.
+        # (mcause is currently disabled to save space)
+        #self.csr.mcause_interrupt.eq( 0 ),
+        #self.csr.mcause_ecode.eq( self.trap_num ),
+        self.csr.mepc_mepc.eq( self.trap_pc[ 2 : 32 ] ),
+        # Disable interrupts globally until MRET or CSR write.
+        self.csr.mstatus_mie.eq( 0 ),
+        # Set PC to the interrupt handler address.
+        self.pc.eq( Cat( Repl( 0, 2 ),
+                        ( self.csr.mtvec_base +
+                          Mux( self.csr.mtvec_mode, self.trap_num, 0 ) ) ) )
+      ]
 
     # End of CPU module definition.
     return m
@@ -377,95 +395,150 @@ class CPU( Elaboratable ):
 # Keep track of test pass / fail rates.
 p = 0
 f = 0
+# ROM images which failed in a multiplexed-ROM simulation.
+failed_images = []
 
 # Import test programs and expected runtime register values.
 from programs import *
 
 # Helper method to check expected CPU register / memory values
-# at a specific point during a test program.
-def check_vals( expected, ni, cpu ):
+# at a specific point during a test program. 'checks' is the list of
+# expected values for the 'ni'th instruction.
+# Values are compared as 32-bit integers; they are only formatted
+# as hex strings when a result gets printed.
+def check_vals( checks, ni, cpu ):
   global p, f
-  if ni in expected:
-    for j in range( len( expected[ ni ] ) ):
-      ex = expected[ ni ][ j ]
-      # Special case: program counter.
-      if ex[ 'r' ] == 'pc':
-        cpc = yield cpu.pc
-        if hexs( cpc ) == hexs( ex[ 'e' ] ):
+  pc  = cpu.pc
+  r   = cpu.r
+  ram = cpu.mem.ram.data
+  for ex in checks:
+    # (Expected values can be negative, e.g. 'e': -2.)
+    exv = ex[ 'e' ] & 0xFFFFFFFF
+    # Special case: program counter.
+    if ex[ 'r' ] == 'pc':
+      cpc = yield pc
+      if cpc == exv:
+        p += 1
+        print( "  \033[32mPASS:\033[0m pc  == %s"
+               " after %d operations"
+               %( hexs( exv ), ni ) )
+      else:
+        f += 1
+        print( "  \033[31mFAIL:\033[0m pc  == %s"
+               " after %d operations (got: %s)"
+               %( hexs( exv ), ni, hexs( cpc ) ) )
+    # Special case: RAM data (must be word-aligned).
+    elif type( ex[ 'r' ] ) == str and ex[ 'r' ][ 0:3 ] == "RAM":
+      rama = int( ex[ 'r' ][ 3: ] )
+      if ( rama % 4 ) != 0:
+        f += 1
+        print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
+               " after %d operations (mis-aligned address)"
+               %( hexs( exv ), rama, ni ) )
+      else:
+        cpd = yield ram[ rama // 4 ]
+        if cpd == exv:
           p += 1
-          print( "  \033[32mPASS:\033[0m pc  == %s"
+          print( "  \033[32mPASS:\033[0m RAM == %s @ 0x%08X"
                  " after %d operations"
-                 %( hexs( ex[ 'e' ] ), ni ) )
+                 %( hexs( exv ), rama, ni ) )
         else:
-          f += 1
-          print( "  \033[31mFAIL:\033[0m pc  == %s"
-                 " after %d operations (got: %s)"
-                 %( hexs( ex[ 'e' ] ), ni, hexs( cpc ) ) )
-      # Special case: RAM data (must be word-aligned).
-      elif type( ex[ 'r' ] ) == str and ex[ 'r' ][ 0:3 ] == "RAM":
-        rama = int( ex[ 'r' ][ 3: ] )
-        if ( rama % 4 ) != 0:
           f += 1
           print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
-                 " after %d operations (mis-aligned address)"
-                 %( hexs( ex[ 'e' ] ), rama, ni ) )
-        else:
-          cpd = yield cpu.mem.ram.data[ rama // 4 ]
-          if hexs( cpd ) == hexs( ex[ 'e' ] ):
-            p += 1
-            print( "  \033[32mPASS:\033[0m RAM == %s @ 0x%08X"
-                   " after %d operations"
-                   %( hexs( ex[ 'e' ] ), rama, ni ) )
-          else:
-            f += 1
-            print( "  \033[31mFAIL:\033[0m RAM == %s @ 0x%08X"
-                   " after %d operations (got: %s)"
-                   %( hexs( ex[ 'e' ] ), rama, ni, hexs( cpd ) ) )
-      # Numbered general-purpose registers.
-      elif ex[ 'r' ] >= 0 and ex[ 'r' ] < 64:
-        cr = yield cpu.r[ ex[ 'r' ] ]
-        rn = ex[ 'r' ] if ex[ 'r' ] < 32 else ( ex[ 'r' ] - 32 )
-        if hexs( cr ) == hexs( ex[ 'e' ] ):
-          p += 1
-          print( "  \033[32mPASS:\033[0m r%02d == %s"
-                 " after %d operations"
-                 %( rn, hexs( ex[ 'e' ] ), ni ) )
-        else:
-          f += 1
-          print( "  \033[31mFAIL:\033[0m r%02d == %s"
                  " after %d operations (got: %s)"
-                 %( rn, hexs( ex[ 'e' ] ),
-                    ni, hexs( cr ) ) )
+                 %( hexs( exv ), rama, ni, hexs( cpd ) ) )
+    # Numbered general-purpose registers.
+    elif ex[ 'r' ] >= 0 and ex[ 'r' ] < 64:
+      cr = yield r[ ex[ 'r' ] ]
+      rn = ex[ 'r' ] if ex[ 'r' ] < 32 else ( ex[ 'r' ] - 32 )
+      if cr == exv:
+        p += 1
+        print( "  \033[32mPASS:\033[0m r%02d == %s"
+               " after %d operations"
+               %( rn, hexs( exv ), ni ) )
+      else:
+        f += 1
+        print( "  \033[31mFAIL:\033[0m r%02d == %s"
+               " after %d operations (got: %s)"
+               %( rn, hexs( exv ),
+                  ni, hexs( cr ) ) )
 
 # Helper method to run a CPU device for a given number of cycles,
 # and verify its expected register values over time.
 def cpu_run( cpu, expected ):
   global p, f
+  # Sort the expected values by instruction count once, so that
+  # each retired instruction only needs to look at the next entry.
+  sched = sorted( ( k, v ) for k, v in expected.items() if k != 'end' )
+  si = 0
+  ns = len( sched )
+  end = expected[ 'end' ]
+  # Look up the MINSTRET signal once; 'cpu' is usually wrapped in a
+  # 'ResetInserter', which forwards each attribute access.
+  minstret = cpu.csr.minstret_instrs
   # Record how many CPU instructions have executed.
   ni = -1
   # Watch for timeouts if the CPU gets into a bad state.
-  timeout = 0
+  # (The deadline only moves when an instruction retires, so
+  #  idle ticks don't need any bookkeeping.)
+  deadline = 1000
   instret = 0
   # Let the CPU run for N ticks.
-  while ni <= expected[ 'end' ]:
-    # Let combinational logic settle before checking values.
-    yield Settle()
-    timeout = timeout + 1
+  # Signal values read right after a 'Tick' are the settled values
+  # from the cycle which just ended, so there's no need to 'Settle'.
+  # (A new MINSTRET value is seen one tick later than it would be
+  #  after a 'Settle', but so are the registers, PC and RAM, so the
+  #  checked state is the same.)
+  for tick in itertools.count():
+    if ni > end:
+      break
     # Only check expected values once per instruction.
-    ninstret = yield cpu.csr.minstret_instrs
+    ninstret = yield minstret
     if ninstret != instret:
       ni += 1
       instret = ninstret
-      timeout = 0
+      deadline = tick + 1000
       # Check expected values, if any.
-      yield from check_vals( expected, ni, cpu )
-    elif timeout > 1000:
+      if ( si < ns ) and ( sched[ si ][ 0 ] == ni ):
+        yield from check_vals( sched[ si ][ 1 ], ni, cpu )
+        si += 1
+    elif tick > deadline:
       f += 1
       print( "\033[31mFAIL: Timeout\033[0m" )
       break
     # Step the simulation.
     yield Tick()
 
+# Helper method to check whether test simulations should create
+# vcd waveform files. Dumping every signal change slows the
+# simulations down, so that only happens if the 'CPU_VCD'
+# environment variable is set to something other than '' or '0'.
+def vcd_enabled():
+  return os.environ.get( 'CPU_VCD', '' ) not in ( '', '0' )
+
+# Helper method to open a simulation's waveform file, if enabled.
+def vcd_open( sim_name ):
+  return open( sim_name, 'w' ) if vcd_enabled() else None
+
+# Helper method to close a finished simulation's waveform file.
+# If 'CPU_VCD' is set to 'fst' and GTKWave's 'vcd2fst' utility is
+# available, the VCD file is converted to the (much smaller) FST
+# format and then removed. (If the conversion fails, the VCD file
+# is kept; waveform tooling problems don't fail the tests.)
+def vcd_close( vcd ):
+  if vcd is None:
+    return
+  vcd.close()
+  if ( os.environ.get( 'CPU_VCD' ) == 'fst' ) and shutil.which( 'vcd2fst' ):
+    fst_name = os.path.splitext( vcd.name )[ 0 ] + '.fst'
+    try:
+      subprocess.run( [ 'vcd2fst', vcd.name, fst_name ], check = True )
+    except ( subprocess.CalledProcessError, OSError ) as e:
+      print( "\033[33mWARNING:\033[0m could not convert %s to FST"
+             " (%s); keeping the VCD file."%( vcd.name, e ) )
+      return
+    os.remove( vcd.name )
+
 # Helper method to simulate running a CPU from simulated SPI
 # Flash which contains a given ROM image. I hope I understood the
 # W25Q datasheet well enough for this to be valid...
@@ -473,21 +546,22 @@ def cpu_spi_sim( test ):
   print( "\033[33mSTART\033[0m running '%s' program (SPI):"%test[ 0 ] )
   # Create the CPU device.
   sim_spi_off = ( 2 * 1024 * 1024 )
-  dut = CPU( SPI_ROM( sim_spi_off, sim_spi_off + 1024, test[ 2 ] ) )
+  # (RAM values are part of the design's initial state.)
+  dut = CPU( SPI_ROM( sim_spi_off, sim_spi_off + 1024, test[ 2 ] ),
+             test[ 3 ] )
   cpu = ResetInserter( dut.clk_rst )( dut )
 
   # Run the simulation.
-  sim_name = "%s_spi.vcd"%test[ 1 ]
-  with Simulator( cpu, vcd_file = open( sim_name, 'w' ) ) as sim:
+  vcd = vcd_open( "%s_spi.vcd"%test[ 1 ] )
+  with Simulator( cpu, vcd_file = vcd ) as sim:
     def proc():
-      for i in range( len( test[ 3 ] ) ):
-        yield cpu.mem.ram.data[ i ].eq( test[ 3 ][ i ] )
       yield from cpu_run( cpu, test[ 4 ] )
       print( "\033[35mDONE\033[0m running %s: executed %d instructions"
              %( test[ 0 ], test[ 4 ][ 'end' ] ) )
     sim.add_clock( 1 / 6000000 )
     sim.add_sync_process( proc )
     sim.run()
+  vcd_close( vcd )
 
 # Helper method to simulate running a CPU with the given ROM image
 # for the specified number of CPU cycles. The 'name' field is used
@@ -497,16 +571,15 @@ def cpu_spi_sim( test ):
 def cpu_sim( test ):
   print( "\033[33mSTART\033[0m running '%s' program:"%test[ 0 ] )
   # Create the CPU device.
-  dut = CPU( ROM( test[ 2 ] ) )
+  # (RAM values are part of the design's initial state.)
+  dut = CPU( ROM( test[ 2 ] ),
+             [ LITTLE_END( v ) for v in test[ 3 ] ] )
   cpu = ResetInserter( dut.clk_rst )( dut )
 
   # Run the simulation.
-  sim_name = "%s.vcd"%test[ 1 ]
-  with Simulator( cpu, vcd_file = open( sim_name, 'w' ) ) as sim:
+  vcd = vcd_open( "%s.vcd"%test[ 1 ] )
+  with Simulator( cpu, vcd_file = vcd ) as sim:
     def proc():
-      # Initialize RAM values.
-      for i in range( len( test[ 3 ] ) ):
-        yield cpu.mem.ram.data[ i ].eq( LITTLE_END( test[ 3 ][ i ] ) )
       # Run the program and print pass/fail for individual tests.
       yield from cpu_run( cpu, test[ 4 ] )
       print( "\033[35mDONE\033[0m running %s: executed %d instructions"
@@ -514,6 +587,7 @@ def cpu_sim( test ):
     sim.add_clock( 1 / 6000000 )
     sim.add_sync_process( proc )
     sim.run()
+  vcd_close( vcd )
 
 # Helper method to simulate running multiple ROM modules in sequence.
 def cpu_mux_sim( tests ):
@@ -527,10 +601,8 @@ def cpu_mux_sim( tests ):
     num_i = num_i + tests[ 2 ][ i ][ 4 ][ 'end' ]
 
   # Run the simulation.
-  sim_name = "%s.vcd"%tests[ 1 ]
-  # (Only create vcd files if necessary; with mux ROMs, they get big)
-  #with Simulator( cpu, vcd_file = open( sim_name, 'w' ) ) as sim:
-  with Simulator( cpu, vcd_file = None ) as sim:
+  vcd = vcd_open( "%s.vcd"%tests[ 1 ] )
+  with Simulator( cpu, vcd_file = vcd ) as sim:
     def proc():
       # Run the programs and print pass/fail for individual tests.
       for i in range( len( tests[ 2 ] ) ):
@@ -545,7 +617,12 @@ def cpu_mux_sim( tests ):
         # Initialize RAM values.
         for j in range( len( tests[ 2 ][ i ][ 3 ] ) ):
           yield cpu.mem.ram.data[ j ].eq( LITTLE_END( tests[ 2 ][ i ][ 3 ][ j ] ) )
+        nf = f
         yield from cpu_run( cpu, tests[ 2 ][ i ][ 4 ] )
+        # Remember which ROM images failed, so that they can be
+        # re-run on their own.
+        if f > nf:
+          failed_images.append( tests[ 2 ][ i ] )
         print( "  \033[34mDONE\033[0m running '%s' ROM image:"
                " executed %d instructions"
                %( tests[ 2 ][ i ][ 0 ], tests[ 2 ][ i ][ 4 ][ 'end' ] ) )
@@ -554,10 +631,69 @@ def cpu_mux_sim( tests ):
     sim.add_clock( 1 / 6000000 )
     sim.add_sync_process( proc )
     sim.run()
+  vcd_close( vcd )
+
+# Helper method to run one test simulation in a worker process.
+# Each simulation builds its own CPU, so they can run in parallel;
+# the pass / fail counts and printed output are returned to the
+# parent process, which prints them in the original test order.
+# (Multiplexed-ROM simulations also return a list of the ROM images
+#  which failed.)
+# (If a simulation raises an exception, it counts as a failure and
+#  its traceback is returned with the rest of its output. Warnings
+#  are captured too, so they stay with the job which raised them.)
+def sim_job( job ):
+  global p, f, failed_images
+  p = 0
+  f = 0
+  failed_images = []
+  out = io.StringIO()
+  with contextlib.redirect_stdout( out ), \
+       contextlib.redirect_stderr( out ):
+    try:
+      job[ 0 ]( job[ 1 ] )
+    except Exception:
+      f += 1
+      print( "\033[31mFAIL: %s simulation raised an exception:\033[0m"
+             %job[ 1 ][ 1 ] )
+      traceback.print_exc( file = sys.stdout )
+  return ( p, f, out.getvalue(), failed_images )
+
+# Helper method to set up each simulation worker process. The
+# warning filters are only installed once per process, so that
+# warnings which are shown once per location stay that way.
+def sim_init():
+  warnings.filterwarnings( "ignore", category = DriverConflict )
+
+# Helper method to give repeated test simulations unique names.
+# Each simulation's waveform file is named after its test, and the
+# simulations run in parallel, so two runs of the same test would
+# otherwise write to the same file at the same time.
+def unique_jobs( jobs ):
+  seen = {}
+  for i, ( sim, test ) in enumerate( jobs ):
+    n = seen.get( ( sim, test[ 1 ] ), 0 )
+    seen[ ( sim, test[ 1 ] ) ] = n + 1
+    if n > 0:
+      jobs[ i ] = ( sim, [ test[ 0 ], "%s_%d"%( test[ 1 ], n ) ] +
+                         list( test[ 2 : ] ) )
+  return jobs
+
+# Helper method to split a multiplexed-ROM test suite into 'n'
+# smaller suites, so that they can be simulated in parallel.
+# (Each part still runs its ROM images in one CPU simulation.)
+def split_suite( tests, n ):
+  k = max( 1, -( -len( tests[ 2 ] ) // n ) )
+  return [ [ tests[ 0 ], "%s_%d"%( tests[ 1 ], i // k ),
+             tests[ 2 ][ i : i + k ] ]
+           for i in range( 0, len( tests[ 2 ] ), k ) ]
 
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
   if ( len( sys.argv ) == 2 ) and ( sys.argv[ 1 ] == '-b' ):
+    # (The board definitions are only needed to build the design,
+    #  so simulations don't have to import them.)
+    from nmigen_boards.upduino_v2 import *
     # Build the application for an iCE40UP5K FPGA.
     # Currently, this is meaningless, because it builds the CPU
     # with a hard-coded 'infinite loop' ROM. But it's a start.
@@ -586,31 +722,75 @@ if __name__ == "__main__":
                                  synth_opts = sopts )
   else:
     # Run testbench simulations.
+    # ('--vcd' is the same as setting 'CPU_VCD=1'; the simulation
+    #  workers inherit the environment variable.)
+    if ( '--vcd' in sys.argv ) and not vcd_enabled():
+      os.environ[ 'CPU_VCD' ] = '1'
     with warnings.catch_warnings():
       warnings.filterwarnings( "ignore", category = DriverConflict )
 
       print( '--- CPU Tests ---' )
-      # Simulate the 'infinite loop' ROM to screen for syntax errors.
-      cpu_sim( loop_test )
-      cpu_spi_sim( loop_test )
-      cpu_sim( ram_pc_test )
-      cpu_spi_sim( ram_pc_test )
-      cpu_sim( quick_test )
-      cpu_spi_sim( quick_test )
+      jobs = [
+        # Simulate the 'infinite loop' ROM to screen for syntax errors.
+        ( cpu_sim, loop_test ),
+        ( cpu_spi_sim, loop_test ),
+        ( cpu_sim, ram_pc_test ),
+        ( cpu_spi_sim, ram_pc_test ),
+        ( cpu_sim, quick_test ),
+        ( cpu_spi_sim, quick_test )
+      ]
       # Run auto-generated RV32I compliance tests with a multiplexed
       # ROM module containing a different program for each one.
-      # (The CPU gets reset between each program.)
-      cpu_mux_sim( rv32i_compliance )
-      # Run non-standard CSR / peripheral tests individually.
-      cpu_sim( minstret_test )
-      cpu_sim( gpio_test )
-      cpu_sim( npx_test )
-
-      # Miscellaneous tests which are not part of the RV32I test suite.
-      # Simulate the 'run from RAM' test ROM.
-      cpu_sim( ram_pc_test )
-      # Simulate a basic 'quick test' ROM.
-      cpu_sim( quick_test )
+      # (The CPU gets reset between each program, and the suite is
+      #  split into one part per CPU core.)
+      jobs += [ ( cpu_mux_sim, part ) for part in
+                split_suite( rv32i_compliance, os.cpu_count() or 1 ) ]
+      jobs += [
+        # Run non-standard CSR / peripheral tests individually.
+        ( cpu_sim, minstret_test ),
+        ( cpu_sim, jump_align_test ),
+        ( cpu_sim, bad_op_test ),
+        ( cpu_sim, gpio_test ),
+        ( cpu_sim, npx_test ),
+        # Miscellaneous tests which are not part of the RV32I test suite.
+        # Simulate the 'run from RAM' test ROM.
+        ( cpu_sim, ram_pc_test ),
+        # Simulate a basic 'quick test' ROM.
+        ( cpu_sim, quick_test )
+      ]
+      # The simulations are independent, so run them in parallel.
+      jobs = unique_jobs( jobs )
+      retry = []
+      with concurrent.futures.ProcessPoolExecutor(
+          initializer = sim_init ) as pool:
+        for job, ( jp, jf, out, fi ) in zip( jobs,
+                                             pool.map( sim_job, jobs ) ):
+          print( out, end = '' )
+          p += jp
+          f += jf
+          # (Only re-run the failed ROM images from a test suite.)
+          if fi:
+            retry += [ ( cpu_mux_sim, [ job[ 1 ][ 0 ], t[ 1 ], [ t ] ] )
+                       for t in fi ]
+          elif jf > 0:
+            retry.append( job )
+
+      # If any simulations failed without creating waveform files,
+      # re-run just those ones with 'CPU_VCD' set so that their
+      # waveforms are available for debugging. (Their results were
+      # already counted above, so the re-runs' output is discarded.)
+      # Test suites only re-run their failed ROM images, so each one
+      # gets its own small waveform file.
+      if retry and not vcd_enabled():
+        os.environ[ 'CPU_VCD' ] = '1'
+        print( "Re-running %d failed simulation(s) to create vcd files..."
+               %len( retry ) )
+        with concurrent.futures.ProcessPoolExecutor(
+            initializer = sim_init ) as pool:
+          for job, _ in zip( retry, pool.map( sim_job, retry ) ):
+            print( "  Created vcd file for %s%s"
+                   %( job[ 1 ][ 1 ],
+                      '_spi' if job[ 0 ] is cpu_spi_sim else '' ) )
 
       # Done; print results.
       print( "CPU Tests: %d Passed, %d Failed"%( p, f ) )
@@ -1,6 +1,5 @@
 from nmigen import *
 from nmigen.back.pysim import *
-from nmigen_boards.upduino_v2 import *
 
 from nmigen_soc.wishbone import *
 from nmigen_soc.memory import *
@@ -76,19 +75,24 @@ class CSR( Elaboratable, Interface ):
                 m.d.sync += getattr( self, "%s_%s"%( cname, bname ) ) \
                   .eq( self.wd[ bits[ 0 ] : ( bits[ 1 ] + 1 ) ] )
 
-    # Process 32-bit CSR write logic.
-    with m.If( ( self.f[ :2 ] ) == 0b01 ):
+    # Process 32-bit CSR write logic. The register and immediate
+    # forms only differ in f[ 2 ], and the CPU already selects the
+    # input value for 'dat_w', so only the two LSbits matter here.
+    # (Set / clear with an input value of 0 leave 'dat_r' unchanged,
+    #  so they don't need a separate 'read-only' comparison.)
+    with m.Switch( self.f[ :2 ] ):
       # 'Write' - set the register to the input value.
-      m.d.comb += self.wd.eq( self.dat_w )
-    with m.Elif( ( ( self.f[ :2 ] ) == 0b10 ) & ( self.dat_w != 0 ) ):
+      with m.Case( 0b01 ):
+        m.d.comb += self.wd.eq( self.dat_w )
       # 'Set' - set bits which are set in the input value.
-      m.d.comb +=  self.wd.eq( self.dat_w | self.dat_r )
-    with m.Elif( ( ( self.f[ :2 ] ) == 0b11 ) & ( self.dat_w != 0 ) ):
+      with m.Case( 0b10 ):
+        m.d.comb += self.wd.eq( self.dat_w | self.dat_r )
       # 'Clear' - reset bits which are set in the input value.
-      m.d.comb += self.wd.eq( ~( self.dat_w ) & self.dat_r )
-    with m.Else():
+      with m.Case( 0b11 ):
+        m.d.comb += self.wd.eq( ~( self.dat_w ) & self.dat_r )
       # Read-only operation; set write data to current value.
-      m.d.comb += self.wd.eq( self.dat_r )
+      with m.Default():
+        m.d.comb += self.wd.eq( self.dat_r )
 
     return m
 
@@ -289,6 +293,7 @@ def csr_test( csr ):
 # 'main' method to run a basic testbench.
 if __name__ == "__main__":
   if ( len( sys.argv ) == 2 ) and ( sys.argv[ 1 ] == '-b' ):
+    from nmigen_boards.upduino_v2 import *
     # Test building the module.
     UpduinoV2Platform().build( CSR(),
                                do_build = True,
@@ -363,9 +363,18 @@ for k, v in CSRS.items():
 def FLIP( v ):
   return Cat( v[ 31 - i ] for i in range( 0, 32 ) )
 
+# Sign-extend the 'n' LSbits of a value to a 32-bit word.
+# (Or zero-extend them, if the optional 'sx' flag is not set.)
+def SEXT( v, n, sx = 1 ):
+  return Cat( v[ :n ], Repl( v[ n - 1 ] & sx, 32 - n ) )
+
 # Convert a 32-bit word to little-endian byte format.
 # 0x1234ABCD -> 0xCDAB3412
 def LITTLE_END( v ):
+  # (Plain integers can use Python's built-in byte conversion.)
+  if isinstance( v, int ):
+    return int.from_bytes( ( v & 0xFFFFFFFF ).to_bytes( 4, 'little' ),
+                           'big' )
   return ( ( ( v & 0x000000FF ) << 24 ) |
            ( ( v & 0x0000FF00 ) << 8  ) |
            ( ( v & 0x00FF0000 ) >> 8  ) |
@@ -503,6 +512,12 @@ def ORI( c, a, i ):
   return RV32I_I( [ OP_IMM, F_ORI ], c, a, i )
 def ANDI( c, a, i ):
   return RV32I_I( [ OP_IMM, F_ANDI ], c, a, i )
+def CSRRW( c, a, i ):
+  return RV32I_I( [ OP_SYSTEM, F_CSRRW ], c, a, i )
+def CSRRS( c, a, i ):
+  return RV32I_I( [ OP_SYSTEM, F_CSRRS ], c, a, i )
+def MRET():
+  return RV32I_I( [ OP_SYSTEM, F_TRAPS ], 0, 0, IMM_MRET )
 # S-type operations:
 def SB( a, b, i ):
   return RV32I_S( [ OP_STORE, F_SB ], a, b, i )
@@ -545,10 +560,7 @@ def LED( a ):
 
 # Helper method to pretty-print a 2s-complement 32-bit hex string.
 def hexs( h ):
-  if h >= 0:
-    return "0x%08X"%( h )
-  else:
-    return "0x%08X"%( ( h + ( 1 << 32 ) ) % ( 1 << 32 ) )
+  return "0x%08X"%( h & 0xFFFFFFFF )
 
 # Helper method to assemble a ROM image from a mix of instructions
 # and assembly pseudo-operations.
@@ -54,6 +54,47 @@ quick_rom = rom_img( [
   JAL( 1, 0x00000 )
 ] )
 
+# "Bad Opcode" program: words whose two LSbits are not '0b11' are
+# not RV32I instructions, so they should be ignored like no-ops.
+# (These are ADDI instructions with their opcode LSbits changed.)
+bad_op_rom = rom_img( [
+  # '..00', '..01', '..10' words (expect r4 = r5 = r6 = 0)
+  LITTLE_END( LITTLE_END( ADDI( 4, 0, 0x005 ) ) & ~0b11 ),
+  LITTLE_END( LITTLE_END( ADDI( 5, 0, 0x006 ) ) & ~0b10 ),
+  LITTLE_END( LITTLE_END( ADDI( 6, 0, 0x007 ) ) & ~0b01 ),
+  # A valid ADDI instruction (expect r7 = 8)
+  ADDI( 7, 0, 0x008 ),
+  # Done; infinite loop.
+  JAL( 1, 0x00000 )
+] )
+
+# "Jump Alignment" program: make sure that JAL / JALR / branch
+# targets which are not word-aligned trap on the jump itself,
+# without writing the 'return PC' register. JALR clears its
+# target's LSbit, so an odd JALR target does not trap.
+jump_align_rom = rom_img( [
+  # Set the trap handler address to 0x00000030.
+  ADDI( 1, 0, 0x030 ), CSRRW( 0, 1, CSRA_MTVEC ),
+  # JALR to 0x00000015 (expect pc = 0x00000014, r5 = 0x00000010)
+  ADDI( 4, 0, 0x015 ), JALR( 5, 4, 0x000 ),
+  # (Skipped by the JALR)
+  ADDI( 6, 0, 0x001 ),
+  # JAL to pc + 2 (expect a trap with mepc = 0x00000014, r7 = 0)
+  JAL( 7, 0x00001 ),
+  # Taken BEQ to pc + 6 (expect a trap with mepc = 0x00000018)
+  BEQ( 0, 0, 0x003 ),
+  # (Expect r8 = 9 after both traps return)
+  ADDI( 8, 0, 0x009 ),
+  # Done; infinite loop.
+  JAL( 0, 0x00000 ),
+  0xDEADBEEF, 0xDEADBEEF, 0xDEADBEEF,
+  # Trap handler: copy mepc to r10, count traps in r9, and
+  # return to the instruction after the one which trapped.
+  CSRRS( 10, 0, CSRA_MEPC ), ADDI( 11, 10, 0x004 ),
+  CSRRW( 0, 11, CSRA_MEPC ), ADDI( 9, 9, 0x001 ),
+  MRET()
+] )
+
 # "LED Test" program: cycle through RGB LED colors.
 led_rom = rom_img( [
   # r15 will hold the LED colors, r14 the loopback address.
@@ -179,6 +220,56 @@ quick_exp = {
   'end': 52
 }
 
+# Expected runtime values for the "Bad Opcode" program.
+bad_op_exp = {
+  # The first three words are skipped without side effects.
+  3:  [
+        { 'r': 'pc', 'e': 0x0000000C },
+        { 'r': 4,    'e': 0x00000000 },
+        { 'r': 5,    'e': 0x00000000 },
+        { 'r': 6,    'e': 0x00000000 }
+      ],
+  # The valid ADDI instruction is executed normally.
+  4:  [
+        { 'r': 'pc', 'e': 0x00000010 },
+        { 'r': 7,    'e': 0x00000008 }
+      ],
+  'end': 5
+}
+
+# Expected runtime values for the "Jump Alignment" program.
+jump_align_exp = {
+  # The JALR target's LSbit is cleared, so it doesn't trap.
+  4:  [
+        { 'r': 'pc', 'e': 0x00000014 },
+        { 'r': 5,    'e': 0x00000010 },
+        { 'r': 6,    'e': 0x00000000 }
+      ],
+  # The JAL to pc + 2 traps, and does not write r7.
+  5:  [
+        { 'r': 'pc', 'e': 0x00000030 },
+        { 'r': 7,    'e': 0x00000000 }
+      ],
+  # The trap handler sees the JAL's address in mepc.
+  6:  [ { 'r': 10, 'e': 0x00000014 } ],
+  # MRET returns to the taken branch after the JAL.
+  10: [
+        { 'r': 'pc', 'e': 0x00000018 },
+        { 'r': 9,    'e': 0x00000001 }
+      ],
+  # The branch to pc + 6 traps, with its address in mepc.
+  11: [ { 'r': 'pc', 'e': 0x00000030 } ],
+  12: [ { 'r': 10, 'e': 0x00000018 } ],
+  # Both traps returned, and the program finished.
+  17: [
+        { 'r': 'pc', 'e': 0x00000020 },
+        { 'r': 7,    'e': 0x00000000 },
+        { 'r': 8,    'e': 0x00000009 },
+        { 'r': 9,    'e': 0x00000002 }
+      ],
+  'end': 18
+}
+
 # LED test program 'expected' values; just a stub to simulate it.
 led_exp = {
   0:  [ { 'r': 'pc', 'e': 0x00000000 } ],
@@ -203,6 +294,10 @@ ram_pc_test  = [ 'run from RAM test', 'cpu_ram',
                  ram_rom, [], ram_exp ]
 quick_test   = [ 'quick test', 'cpu_quick',
                  quick_rom, [], quick_exp ]
+bad_op_test  = [ 'bad opcode test', 'cpu_bad_op',
+                 bad_op_rom, [], bad_op_exp ]
+jump_align_test = [ 'jump alignment test', 'cpu_jump_align',
+                    jump_align_rom, [], jump_align_exp ]
 led_test     = [ 'led test', 'cpu_led',
                  led_rom, [], led_exp ]
 gpio_test    = [ 'gpio test', 'cpu_gpio',
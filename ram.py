@@ -16,14 +16,14 @@ RAM_DW_16 = 1
 RAM_DW_32 = 2
 
 class RAM( Elaboratable ):
-  def __init__( self, size_words ):
+  def __init__( self, size_words, init = None ):
     # Record size.
     self.size = ( size_words * 4 )
     # Width of data input.
     self.dw   = Signal( 3, reset = 0b000 )
-    # Data storage.
+    # Data storage. Words which are not listed in 'init' start as 0.
     self.data = Memory( width = 32, depth = size_words,
-      init = ( 0x000000 for i in range( size_words ) ) )
+      init = init )
     # Read and write ports.
     self.r = self.data.read_port()
     self.w = self.data.write_port()
@@ -52,12 +52,15 @@ class RAM( Elaboratable ):
     m.submodules.w = self.w
     m.submodules.arb = self.arb
 
-    # Ack two cycles after activation, for memory port access and
-    # synchronous read-out (to prevent combinatorial loops).
-    rws = Signal( 1, reset = 0 )
+    # Ack one cycle after activation: the synchronous read port's
+    # data is valid by then, so it can be passed through to the bus
+    # without another register stage. The byte offset is registered
+    # alongside the read port's address, so the read-out logic does
+    # not form a combinatorial loop with the bus address.
+    ba = Signal( 2, reset = 0b00 )
     m.d.sync += [
-      rws.eq( self.arb.bus.cyc ),
-      self.arb.bus.ack.eq( self.arb.bus.cyc & rws )
+      ba.eq( self.arb.bus.adr[ :2 ] ),
+      self.arb.bus.ack.eq( self.arb.bus.cyc & ~self.arb.bus.ack )
     ]
 
     m.d.comb += [
@@ -65,12 +68,12 @@ class RAM( Elaboratable ):
       self.r.addr.eq( self.arb.bus.adr >> 2 ),
       self.w.addr.eq( self.r.addr ),
       # Set the 'write enable' flag once the reads are valid.
-      self.w.en.eq( rws & self.arb.bus.we )
+      self.w.en.eq( self.arb.bus.ack & self.arb.bus.we )
     ]
 
-    # Read logic: it's synchronous to avoid combinatorial loops.
-    m.d.sync += self.arb.bus.dat_r.eq( self.r.data >>
-      ( self.arb.bus.adr[ :2 ] << 3 ) )
+    # Read logic: the read port and byte offset are registered,
+    # so the output can be combinatorial.
+    m.d.comb += self.arb.bus.dat_r.eq( self.r.data >> ( ba << 3 ) )
 
     # Write logic:
     m.d.comb += self.w.data.eq( self.r.data )
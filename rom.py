@@ -42,12 +42,15 @@ class ROM( Elaboratable ):
     m.submodules.arb = self.arb
     m.submodules.r = self.r
 
-    # Ack two cycles after activation, for memory port access and
-    # synchronous read-out (to prevent combinatorial loops).
-    rws = Signal( 1, reset = 0 )
+    # Ack one cycle after activation: the synchronous read port's
+    # data is valid by then, so it can be passed through to the bus
+    # without another register stage. The byte offset is registered
+    # alongside the read port's address, so the read-out logic does
+    # not form a combinatorial loop with the bus address.
+    ba = Signal( 2, reset = 0b00 )
     m.d.sync += [
-      rws.eq( self.arb.bus.cyc ),
-      self.arb.bus.ack.eq( self.arb.bus.cyc & rws )
+      ba.eq( self.arb.bus.adr[ :2 ] ),
+      self.arb.bus.ack.eq( self.arb.bus.cyc & ~self.arb.bus.ack )
     ]
 
     # Set read port address (in words).
@@ -57,12 +60,12 @@ class ROM( Elaboratable ):
     # If a read would 'spill over' into an out-of-bounds data byte,
     # set that byte to 0x00.
     # Word-aligned reads
-    with m.If( ( self.arb.bus.adr & 0b11 ) == 0b00 ):
-      m.d.sync += self.arb.bus.dat_r.eq( LITTLE_END_L( self.r.data ) )
+    with m.If( ba == 0b00 ):
+      m.d.comb += self.arb.bus.dat_r.eq( LITTLE_END_L( self.r.data ) )
     # Un-aligned reads
     with m.Else():
-      m.d.sync += self.arb.bus.dat_r.eq(
-        LITTLE_END_L( self.r.data << ( ( self.arb.bus.adr & 0b11 ) << 3 ) ) )
+      m.d.comb += self.arb.bus.dat_r.eq(
+        LITTLE_END_L( self.r.data << ( ba << 3 ) ) )
 
     # End of ROM module definition.
     return m
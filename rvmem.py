@@ -27,7 +27,7 @@ from ram import *
 #############################################################
 
 class RV_Memory( Elaboratable ):
-  def __init__( self, rom_module, ram_words ):
+  def __init__( self, rom_module, ram_words, ram_init = None ):
     # Memory multiplexers.
     # Data bus multiplexer.
     self.dmux = Decoder( addr_width = 32,
@@ -40,7 +40,7 @@ class RV_Memory( Elaboratable ):
 
     # Add ROM and RAM buses to the data multiplexer.
     self.rom = rom_module
-    self.ram = RAM( ram_words )
+    self.ram = RAM( ram_words, ram_init )
     self.rom_d = self.rom.new_bus()
     self.ram_d = self.ram.new_bus()
     self.dmux.add( self.rom_d,    addr = 0x00000000 )
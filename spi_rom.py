@@ -3,7 +3,6 @@ from math import ceil, log2
 from nmigen.back.pysim import *
 from nmigen_soc.memory import *
 from nmigen_soc.wishbone import *
-from nmigen_boards.resources import *
 
 from isa import *
 